@@ -1,13 +1,24 @@
 import ruamel.yaml as ryaml
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
+from collections.abc import Iterable, Iterator
 from datetime import datetime, timezone
+import functools
 import hashlib
 from io import BytesIO
+import json
+from multiprocessing.shared_memory import SharedMemory
 import re
 
 
 class Objects:
+    HASHED_METADATA = {b'dmp:hashed': b'true'}
+    _HASH_SIZE = 64
+    _HEX = b'0123456789abcdefABCDEF'
 
     def read_yaml_bytes(bytes) -> dict:
         yaml_content = bytes.decode('utf-8')
@@ -31,6 +42,177 @@ class Objects:
         data = BytesIO(bytes)
         return pd.read_parquet(data)
 
+    def gzip_parquet_to_table(bytes: bytes) -> pa.Table:
+        return pq.read_table(BytesIO(bytes))
+
+    def df_to_gzip_parquet(
+            df: pd.DataFrame, metadata: dict | None = None) -> bytes:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if metadata:
+            table = table.replace_schema_metadata(
+                {**(table.schema.metadata or {}), **metadata})
+        stream = BytesIO()
+        pq.write_table(table, stream, compression='gzip')
+        parquet_bytes = stream.getvalue()
+        stream.close()
+        return parquet_bytes
+
+    def parquet_row_groups(bytes: bytes) -> int:
+        return pq.ParquetFile(BytesIO(bytes)).num_row_groups
+
+    def parquet_num_rows(bytes: bytes) -> int:
+        return pq.ParquetFile(BytesIO(bytes)).metadata.num_rows
+
+    def gzip_parquet_batches(
+            bytes: bytes, batch_size: int) -> Iterator[pa.RecordBatch]:
+        parquet = pq.ParquetFile(BytesIO(bytes))
+        yield from parquet.iter_batches(batch_size=batch_size)
+
+    def batches_to_gzip_parquet(
+            batches: Iterable[pa.RecordBatch], schema: pa.Schema,
+            metadata: dict | None = None) -> bytes:
+        stream = BytesIO()
+        Objects.write_gzip_parquet(stream, batches, schema, metadata)
+        parquet_bytes = stream.getvalue()
+        stream.close()
+        return parquet_bytes
+
+    def write_gzip_parquet(
+            sink: str | BytesIO, batches: Iterable[pa.RecordBatch],
+            schema: pa.Schema, metadata: dict | None = None) -> None:
+        if metadata:
+            schema = schema.with_metadata(
+                {**(schema.metadata or {}), **metadata})
+        with pq.ParquetWriter(sink, schema, compression='gzip') as writer:
+            for batch in batches:
+                writer.write_table(
+                    pa.Table.from_batches([batch]).cast(schema))
+
+    def to_shared_memory(bytes: bytes) -> SharedMemory:
+        shared = SharedMemory(create=True, size=max(len(bytes), 1))
+        shared.buf[:len(bytes)] = bytes
+        return shared
+
+    def table_to_shared_memory(table: pa.Table) -> tuple[str, int]:
+        # Arrow IPC stream written straight into a new shared memory
+        # block, handed over by name to be read and unlinked by the caller.
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        buffer = sink.getvalue()
+        shared = SharedMemory(create=True, size=max(buffer.size, 1))
+        shared.buf[:buffer.size] = memoryview(buffer).cast('B')
+        shared.close()
+        return shared.name, buffer.size
+
+    def table_to_columns(table: pa.Table) -> dict[str, list]:
+        # Slicing one flat list of values per column by its offsets is
+        # several times faster than Table.to_pylist for list columns.
+        columns = {}
+        for name in table.column_names:
+            column = table.column(name).combine_chunks()
+            if pa.types.is_list(column.type) and column.null_count == 0:
+                offsets = column.offsets.to_numpy().tolist()
+                values = column.values.to_numpy(
+                    zero_copy_only=False).tolist()
+                columns[name] = [
+                    values[start:end]
+                    for start, end in zip(offsets, offsets[1:])
+                ]
+            else:
+                columns[name] = column.to_pylist()
+        return columns
+
+    def table_to_records(table: pa.Table) -> list[dict]:
+        columns = Objects.table_to_columns(table)
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+    def list_columns_to_json(columns: list[pa.Array]) -> bytes | None:
+        # Comma separated JSON arrays, one per row and in row order, of
+        # the values of the given list columns. Rows without any value are
+        # dropped, and None returned when none is left.
+        columns = [
+            column.combine_chunks() if isinstance(column, pa.ChunkedArray)
+            else column
+            for column in columns
+        ]
+        counts = [
+            pc.fill_null(pc.list_value_length(column), 0)
+            for column in columns
+        ]
+        keep = functools.reduce(
+            pc.or_, (pc.greater(count, 0) for count in counts))
+        if not pc.any(keep).as_py():
+            return None
+        columns = [column.filter(keep) for column in columns]
+        counts = [count.filter(keep) for count in counts]
+        if not all(
+            Objects._is_hash_array(pc.list_flatten(column))
+            for column in columns
+        ):
+            # Anything but hashed values is left to the json module.
+            rows = zip(*(column.to_pylist() for column in columns))
+            return json.dumps([list(row) for row in rows])[1:-1].encode(
+                'utf-8')
+        # Hashed values need no escaping, so rows are joined as text.
+        arrays = [
+            pc.if_else(
+                pc.greater(count, 0),
+                pc.binary_join_element_wise(
+                    '["', pc.binary_join(column, '", "'), '"]', ''),
+                '[]')
+            for column, count in zip(columns, counts)
+        ]
+        rows = pc.binary_join_element_wise(
+            '[', pc.binary_join_element_wise(*arrays, ', '), '], ', '')
+        # The rows are contiguous in the data buffer, less the separator
+        # after the last one.
+        offsets, data = rows.buffers()[1:]
+        start, end = np.frombuffer(offsets, dtype=np.int32)[
+            [rows.offset, rows.offset + len(rows)]]
+        return data.slice(start, end - start - len(b', ')).to_pybytes()
+
+    def _is_hash_array(values: pa.Array) -> bool:
+        # Every value as long as a hash, and all of them hex digits.
+        if values.null_count or not pc.all(pc.equal(
+                pc.binary_length(values), Objects._HASH_SIZE),
+                min_count=0).as_py():
+            return False
+        offsets, data = values.buffers()[1:]
+        if data is None:
+            return True
+        start = int(np.frombuffer(offsets, dtype=np.int32)[values.offset])
+        text = data.slice(start, len(values) * Objects._HASH_SIZE)
+        return not text.to_pybytes().translate(None, Objects._HEX)
+
+    def shared_memory_to_records(name: str, size: int) -> list[dict]:
+        shared = SharedMemory(name=name)
+        try:
+            reader = pa.ipc.open_stream(pa.py_buffer(shared.buf[:size]))
+            records = Objects.table_to_records(reader.read_all())
+            del reader
+        finally:
+            shared.close()
+            shared.unlink()
+        return records
+
+    def unlink_shared_memory(name: str) -> None:
+        shared = SharedMemory(name=name)
+        shared.close()
+        shared.unlink()
+
+    def parquet_metadata(bytes: bytes) -> dict[bytes, bytes]:
+        return pq.read_schema(BytesIO(bytes)).metadata or {}
+
+    def is_hashed(bytes: bytes | None) -> bool:
+        if not bytes:
+            return False
+        metadata = Objects.parquet_metadata(bytes)
+        return all(
+            metadata.get(key) == value
+            for key, value in Objects.HASHED_METADATA.items()
+        )
+
 
 class Hash:
 
@@ -48,6 +230,34 @@ class Hash:
         hash.update(str.encode('utf-8'))
         return hash.hexdigest()
 
+    def sha256_bytes(bytes: bytes) -> str:
+        return hashlib.sha256(bytes).hexdigest()
+
+    def row_keys(frame: pd.DataFrame) -> np.ndarray:
+        # One exact key per member row, independent of the order of the
+        # values within each multi-value field.
+        columns = [
+            frame[column].map(
+                lambda values: ','.join(sorted(values))
+                if values is not None else '')
+            for column in frame.columns
+        ]
+        if not columns or frame.empty:
+            return np.array([], dtype=str)
+        keys = columns[0].str.cat(columns[1:], sep='|')
+        return keys.to_numpy(dtype=str)
+
+    def content_hash(frames: Iterable[pd.DataFrame]) -> str:
+        # Sum of the row key digests modulo 2^256, so the same members
+        # give the same hash in any row order and however batched.
+        total = 0
+        for frame in frames:
+            for key in Hash.row_keys(frame).tolist():
+                total += int.from_bytes(
+                    hashlib.sha256(key.encode('utf-8')).digest(), 'big')
+            total %= 2 ** 256
+        return total.to_bytes(32, 'big').hex()
+
 
 class Time:
 
@@ -0,0 +1,8 @@
+import importlib
+import pkgutil
+
+
+# Every module of the package is imported along with it, for the adtechs
+# it defines to register under their state block key.
+for _module in pkgutil.iter_modules(__path__):
+    importlib.import_module(f'{__name__}.{_module.name}')
@@ -1,18 +1,36 @@
+import pyarrow as pa
 import requests
 
+from spill import SpilledPayloads, SpilledRecords
+from _utils import Objects
+
 from abc import ABC, abstractmethod
+from collections.abc import Iterable, Iterator
 from enum import Enum, unique
+import json
 
 
 class Adtech(ABC):
+    # Concrete adtechs register themselves under the key of their block
+    # in the audience state file.
+    STATE_KEY: str | None = None
+    registry: dict[str, type['Adtech']] = {}
+    # Adtechs with a tabular payload build it from the Arrow table of the
+    # members with _encode_columns, instead of row by row.
+    _COLUMNAR: bool = False
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        if cls.STATE_KEY is not None:
+            Adtech.registry[cls.STATE_KEY] = cls
+
     def __init__(
             self, name: str, description: str,
             state: dict, member_records: list[dict]) -> None:
         self._state = state
-        self.audience_id = self._sstate.get(..., None)
+        self.audience_id = self._state.get('id', None)
         self.audience_name = name
         self.audience_description = description
-        ...
         self._member_records: list[dict] = member_records
         self._status = self.Status.check(
             self.audience_id,
@@ -20,8 +38,7 @@ class Adtech(ABC):
         )
         self._response: dict = state.get('last_response', {})
         if self._status.value == 0:
-            self.payload: dict = self._format_payload()
-            self.api = Adtech.API({
+            self.api = self.API({
                 'access_token': 'access_token',
                 'advertiser_id': 'advertiser_id'
             })
@@ -33,7 +50,6 @@ class Adtech(ABC):
         POSTED = 1
 
         @classmethod
-        @abstractmethod
         def check(
             cls, audience_id: str, member_records: list[dict]
         ) -> 'Adtech.Status':
@@ -48,8 +64,8 @@ class Adtech(ABC):
     def state(self) -> dict:
         self._state = {
             'name': self.audience_name,
-            ...: ...,
-            'id': self.id,
+            'id': self.response.get('id', self.audience_id),
+            **self.params,
             'last_response': {
                 'date': self.response.get('date', None),
                 'status': self.response.get('status', None),
@@ -60,75 +76,182 @@ class Adtech(ABC):
 
     @property
     @abstractmethod
+    def params(self) -> dict:
+        # Adtech specific parameters of the state block.
+        ...
+
+    @property
     def status(self) -> 'Adtech.Status':
         return self._status
 
     @status.setter
-    @abstractmethod
     def status(self, value) -> None:
         self._status = value
 
     @property
-    @abstractmethod
     def member_records(self) -> list[dict]:
         return self._member_records
 
     @member_records.setter
-    @abstractmethod
     def member_records(self, value) -> None:
         self._member_records = value
 
     @property
-    @abstractmethod
     def response(self) -> dict:
         return self._response
 
     @response.setter
-    @abstractmethod
     def response(self, value) -> None:
         self._response = value
 
     @abstractmethod
-    def _format_payload(self) -> dict:
-        payload = {
-            "name": self.audience_name,
-            "description": self.audience_description,
-            ...: ...
-        }
+    def _encode_member(self, record: dict) -> dict | list:
+        # One member record as a row of the payload data.
+        ...
 
-        def _inject_members(payload: dict) -> dict:
+    @abstractmethod
+    def _format_payload(self, rows: list) -> dict:
+        # Encoded member rows wrapped in the adtech request body.
+        ...
 
-            data = [
-                {
-                    "emails": [em for em in dct["email"]],
-                    "phoneNumbers": [ph for ph in dct["phone_number"]],
-                    "zipCodes": [zp for zp in dct["zip_code"]]
-                }
-                for dct in self.member_records
-            ]
-            payload.update({"data": [data]})
-            return payload
-
-        def _drop_empty_keys(dct: dict) -> dict:
-            new_dict = {}
-            for key, value in dct.items():
-                if isinstance(value, dict):
-                    value = _drop_empty_keys(value)
-                elif isinstance(value, list):
-                    value = [v for v in value if v]
-                    if not value:
-                        continue
-                if value:
-                    new_dict[key] = value
-            return new_dict
-
-        payload = _inject_members(payload)
-        payload = _drop_empty_keys(payload)
-        return payload
+    @staticmethod
+    def _drop_empty_keys(dct: dict) -> dict:
+        new_dict = {}
+        for key, value in dct.items():
+            if isinstance(value, dict):
+                value = Adtech._drop_empty_keys(value)
+            elif isinstance(value, list):
+                value = [v for v in value if v]
+                if not value:
+                    continue
+            if value:
+                new_dict[key] = value
+        return new_dict
 
-    @abstractmethod
-    def upload(self) -> None:
-        response = self.api.post(self.payload)
+    @staticmethod
+    def encode(
+            adtechs: Iterable['Adtech'],
+            member_records: list[dict] | SpilledRecords,
+            schema: pa.Schema | None = None) -> None:
+        # Builds the payloads of all adtechs still to be posted in a
+        # single pass over the shared member records, or from their Arrow
+        # table for columnar adtechs. Spilled members are encoded batch by
+        # batch into payloads kept on disk.
+        pending = [adtech for adtech in adtechs if adtech.status.value == 0]
+        if not pending:
+            return
+        by_row = [adtech for adtech in pending if not adtech._COLUMNAR]
+        by_column = [adtech for adtech in pending if adtech._COLUMNAR]
+
+        spilled = isinstance(member_records, SpilledRecords)
+        if spilled:
+            for adtech in pending:
+                adtech.payload = SpilledPayloads()
+            tables = (
+                pa.Table.from_batches([batch])
+                for batch in member_records.spill.batches()
+            )
+            batches = (
+                (Objects.table_to_records(table) if by_row else [], table)
+                for table in tables
+            )
+        else:
+            table = pa.Table.from_pylist(
+                member_records, schema=schema) if by_column else None
+            batches = [(member_records, table)]
+
+        for records, table in batches:
+            payloads = {}
+            rows = [[] for _ in by_row]
+            for dct in records:
+                for adtech, adtech_rows in zip(by_row, rows):
+                    adtech_rows.append(adtech._encode_member(dct))
+            for adtech, adtech_rows in zip(by_row, rows):
+                payloads[adtech] = Adtech._drop_empty_keys(
+                    adtech._format_payload(adtech_rows))
+            for adtech in by_column:
+                payloads[adtech] = adtech._encode_columns(table)
+            for adtech in pending:
+                if spilled:
+                    adtech.payload.append(payloads[adtech])
+                else:
+                    adtech.payload = payloads[adtech]
+
+    def _encode_columns(
+            self, table: pa.Table) -> 'dict | Adtech.JsonBody':
+        # Request body of a columnar adtech from the table of the members.
+        # Adtechs without an encoder of their own go row by row.
+        rows = [
+            self._encode_member(record)
+            for record in Objects.table_to_records(table)
+        ]
+        return Adtech._drop_empty_keys(self._format_payload(rows))
+
+    class JsonBody:
+        # Request body serialized ahead of the post: the payload fields,
+        # then one array of rows already encoded as JSON, iterated in
+        # chunks to be streamed into the request.
+        _CHUNK_SIZE = 1_048_576
+
+        def __init__(self, fields: dict, key: str, rows: bytes | None) -> None:
+            self.fields = fields
+            self.key = key
+            self.rows = rows
+
+        def __iter__(self) -> Iterator[bytes]:
+            head = json.dumps(self.fields).encode('utf-8')
+            if self.rows is None:
+                yield head
+                return
+            separator = b', ' if self.fields else b''
+            yield (
+                head[:-1] + separator
+                + json.dumps(self.key).encode('utf-8') + b': ['
+            )
+            view = memoryview(self.rows)
+            for start in range(0, len(view), self._CHUNK_SIZE):
+                yield bytes(view[start:start + self._CHUNK_SIZE])
+            yield b']}'
+
+        def to_dict(self) -> dict:
+            return json.loads(b''.join(self))
+
+    def reset(self) -> None:
+        self._status = self.Status.check(None, self.member_records)
+        if self._status.value == 0:
+            self.api = self.API({
+                'access_token': 'access_token',
+                'advertiser_id': 'advertiser_id'
+            })
+
+    def restore(self, response: dict) -> None:
+        self.response = response
+        self.audience_id = response.get('id', self.audience_id)
+        self._status = self.Status.POSTED
+
+    def upload(self) -> dict:
+        # Audiences already created at the adtech have their members
+        # replaced under the same id when the content changed. Payloads
+        # spilled in batches send the first one that way, and append the
+        # others to the audience.
+        payloads = (
+            self.payload if isinstance(self.payload, SpilledPayloads)
+            else [self.payload]
+        )
+        response = {}
+        for payload in payloads:
+            if response.get('id'):
+                response = {
+                    'id': response['id'],
+                    **self.api.append(response['id'], payload)
+                }
+            elif self.audience_id:
+                response = {
+                    'id': self.audience_id,
+                    **self.api.replace(self.audience_id, payload)
+                }
+            else:
+                response = self.api.post(payload)
         self.response = response
         return response
 
@@ -148,15 +271,46 @@ class Adtech(ABC):
                 for k, v in self._HEADERS.items()
             }
             self.endpoint: str = self._ENDPOINT.format(
-                version=Adtech.API._API_VERSION,
+                version=self._API_VERSION,
                 advertiserId=str(_advertiser_id)
             )
 
         @abstractmethod
-        def post(self, payload: dict) -> requests.Response:
-            response = requests.get(
+        def post(
+                self, payload: 'dict | Adtech.JsonBody') -> requests.Response:
+            response = requests.post(
                 self.endpoint,
                 headers=self.headers,
-                json=payload
+                **self._body(payload)
+            )
+            return response
+
+        @abstractmethod
+        def append(
+                self, audience_id: str,
+                payload: 'dict | Adtech.JsonBody') -> requests.Response:
+            response = requests.post(
+                f'{self.endpoint}&audienceId={audience_id}',
+                headers=self.headers,
+                **self._body(payload)
             )
             return response
+
+        @abstractmethod
+        def replace(
+                self, audience_id: str,
+                payload: 'dict | Adtech.JsonBody') -> requests.Response:
+            response = requests.put(
+                f'{self.endpoint}&audienceId={audience_id}',
+                headers=self.headers,
+                **self._body(payload)
+            )
+            return response
+
+        @staticmethod
+        def _body(payload: 'dict | Adtech.JsonBody') -> dict:
+            # Bodies already serialized are streamed in chunks, sent with
+            # chunked transfer encoding.
+            if isinstance(payload, Adtech.JsonBody):
+                return {'data': iter(payload)}
+            return {'json': payload}
@@ -1,49 +1,216 @@
+import numpy as np
+import pandas as pd
 import phonenumbers
-from pydantic import BaseModel, validator
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pydantic import BaseModel, ValidationInfo, field_validator
 
-from adtechs.adtechA import AdtechA
-from adtechs.adtechB import AdtechB
+from adtechs._adtech import Adtech
+from datasource._datasource import DataSource
 from datasource.apigateway import ApiGateway
+from datasource.segment import Segment
+from spill import Spill, SpilledPayloads, SpilledRecords
 from _utils import Hash, Objects
 
-import re
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import ContextVar
+import functools
+import inspect
+import json
+from multiprocessing.shared_memory import SharedMemory
+from typing import ClassVar
+
+
+# Validation counters of the members being validated in this thread, per
+# field: values found invalid, empty, already hashed, deduplicated within
+# a member, and fields split into several values.
+_quality: ContextVar[dict | None] = ContextVar('_quality', default=None)
+_COUNTERS = ('invalid', 'empty', 'hashed', 'deduplicated', 'split')
+
+
+def _count(
+        field: str, counter: str, count: int = 1,
+        quality: dict | None = None) -> None:
+    quality = quality if quality is not None else _quality.get()
+    if quality is not None:
+        counters = quality.setdefault(field, dict.fromkeys(_COUNTERS, 0))
+        counters[counter] += count
 
 
 class Audience:
-    def __init__(self, state: dict, data: bytes | None) -> None:
+    # Rough in-memory size of one member in each of its copies: the
+    # members themselves and each adtech payload.
+    _MEMBER_FOOTPRINT = 1_024
+
+    def __init__(
+            self, state: dict, data: bytes | None,
+            loader: Callable[[str], pa.Table | None] | None = None,
+            workers: int = 1, memory_budget: int | None = None,
+            journal: Callable[..., None] | None = None,
+            uploaded: dict[str, dict] | None = None,
+            normalized: bytes | None = None
+    ) -> None:
         self._state: dict = state
         self.name = list(state.keys())[0]
         _state = state.get(self.name)
         self.description = _state.get('description')
-        self.source: dict = ApiGateway(_state.get('source'))
+        # Scheduling hints, kept as they are in the state file.
+        self.priority: int | None = _state.get('priority')
+        self.deadline: str | None = _state.get('deadline')
+        self._journal = journal
+        _source = _state.get('source')
+        self.source: DataSource = (
+            Segment(_source, loader) if Segment.is_segment(_source)
+            else ApiGateway(_source)
+        )
 
         if data is None:
             self.data: bytes = self.source.get_audience_data()
         else:
             self.data: bytes = data
 
-        self.members: list[Audience.Member] | None = (
-            Audience.Member.from_bytes(self.data))
+        _adtech_keys = [key for key in _state if key in Adtech.registry]
+        self._member_copies = 1 + len(_adtech_keys)
+
+        # Hashed members cached from a previous run for the same data are
+        # loaded as they are, instead of validating the data again.
+        _members_data = normalized if normalized is not None else self.data
+
+        # Validation counters of the last normalization of the data, kept
+        # as they are when the members did not have to be validated.
+        _quality = {}
+        self.memory_budget = memory_budget
+        if self._exceeds_budget():
+            # Hashed members go to disk in batches sized to a fraction of
+            # the budget, and so do the adtech payloads built from them.
+            batch_size = max(1, self.memory_budget // (
+                4 * self._MEMBER_FOOTPRINT * self._member_copies))
+            self.members: SpilledRecords = Audience.Member.spill(
+                _members_data, batch_size, quality=_quality)
+        else:
+            self.members: list[Audience.Member] | None = (
+                Audience.Member.from_bytes(
+                    _members_data, workers=workers, quality=_quality))
+        self.quality: dict | None = (
+            _quality or Audience.Member.stored_quality(normalized)
+            or (_source or {}).get('quality'))
+
+        _data_hash = _state.get('data_hash')
+        self.data_hash: str | None = (
+            Hash.content_hash(Audience.Member.to_frames(self.members))
+            if self.members is not None else _data_hash
+        )
+        self.is_changed: bool = (
+            self.members is not None and self.data_hash != _data_hash)
+        # Data read back from under the audience name, as stored before
+        # content addressing.
+        self.is_legacy: bool = (
+            self.is_changed and _data_hash is None
+            and not self.source.is_new)
 
+        _member_records = Audience.Member.to_records(self.members)
         _adtech_args = {
             'name': self.name,
             'description': self.description,
-            'member_records': Audience.Member.to_records(self.members)
+            'member_records': _member_records
+        }
+
+        # One instance per adtech block of the state file.
+        self.adtechs: dict[str, Adtech] = {
+            key: Adtech.registry[key](**_adtech_args, state=_state[key])
+            for key in _adtech_keys
+        }
+
+        # Only a change of content since the last recorded hash sends
+        # already posted audiences to the adtechs again.
+        if self.is_changed is True and _data_hash is not None:
+            for adtech in self.adtechs.values():
+                adtech.reset()
+
+        # Uploads completed by an interrupted run are not posted again.
+        for key, response in (uploaded or {}).items():
+            if key in self.adtechs:
+                self.adtechs[key].restore(response)
+
+        Adtech.encode(
+            self.adtechs.values(), _member_records, Audience.Member.SCHEMA)
+
+    @property
+    def adtech_a(self) -> Adtech | None:
+        return self.adtechs.get('adtechA')
+
+    @property
+    def adtech_b(self) -> Adtech | None:
+        return self.adtechs.get('adtechB')
+
+    def upload(self) -> dict[str, dict]:
+        # Posts to every adtech not yet posted, concurrently.
+        pending = {
+            key: adtech for key, adtech in self.adtechs.items()
+            if adtech.status.value == 0
         }
+        if not pending:
+            return {}
+        with ThreadPoolExecutor(len(pending)) as pool:
+            futures = {
+                key: pool.submit(self._upload, key, adtech)
+                for key, adtech in pending.items()
+            }
+            responses = {
+                key: future.result() for key, future in futures.items()}
+        return responses
 
-        self.adtech_a = AdtechA(
-            **_adtech_args, state=_state.get('adtechA', None))
-        self.adtech_b = AdtechB(
-            **_adtech_args, state=_state.get('adtechB', None))
+    def _exceeds_budget(self) -> bool:
+        if self.memory_budget is None or not self.data:
+            return False
+        estimate = len(self.data) + (
+            Objects.parquet_num_rows(self.data)
+            * self._MEMBER_FOOTPRINT * self._member_copies
+        )
+        return estimate > self.memory_budget
+
+    @property
+    def spilled_bytes(self) -> int:
+        spilled = 0
+        if isinstance(self.members, SpilledRecords):
+            spilled += self.members.spill.nbytes
+        for adtech in self.adtechs.values():
+            if isinstance(getattr(adtech, 'payload', None), SpilledPayloads):
+                spilled += adtech.payload.nbytes
+        return spilled
+
+    def _upload(self, key: str, adtech: Adtech) -> dict:
+        # Journaled as soon as posted, for a resumed run not to post it
+        # again.
+        response = adtech.upload()
+        if self._journal is not None:
+            self._journal(
+                self.name, 'uploaded', adtech=key, response=response)
+        return response
 
     @property
     def state(self) -> dict:
         self._state = {
             self.name: {
                 'description': self.description,
-                'source': self.source.state,
-                'adtechA': self.adtech_a.state,
-                'adtechB': self.adtech_b.state
+                **({
+                    'priority': self.priority
+                } if self.priority is not None else {}),
+                **({
+                    'deadline': self.deadline
+                } if self.deadline is not None else {}),
+                'data_hash': self.data_hash,
+                'source': {
+                    **self.source.state,
+                    **({
+                        'quality': self.quality
+                    } if self.quality else {})
+                },
+                **{
+                    key: adtech.state
+                    for key, adtech in self.adtechs.items()
+                }
             }
         }
         return self._state
@@ -54,6 +221,13 @@ class Audience:
         phone_number: list
         zip_code: list
 
+        SCHEMA: ClassVar[pa.Schema] = pa.schema([
+            ('email', pa.list_(pa.string())),
+            ('phone_number', pa.list_(pa.string())),
+            ('zip_code', pa.list_(pa.string()))
+        ])
+        QUALITY_METADATA: ClassVar[bytes] = b'dmp:quality'
+
         class Config:
             arbitrary_types_allowed = True
 
@@ -61,79 +235,273 @@ class Audience:
             super().__init__(**data)
 
         @classmethod
-        def from_bytes(cls, bytes_: bytes | None) -> list['Audience.Member']:
+        @functools.cache
+        def version(cls) -> str:
+            # Changes whenever the normalization code or the phone number
+            # metadata it relies on change.
+            source = (
+                inspect.getsource(cls) + inspect.getsource(Hash)
+                + phonenumbers.__version__
+            )
+            return Hash._sha256(source)[:12]
+
+        @classmethod
+        def validate_records(
+            cls, records: list[dict], quality: dict | None = None
+        ) -> list['Audience.Member']:
+            # The validators add up their counters per field into quality
+            # as they go, if given.
+            if quality is not None:
+                for field in cls.model_fields:
+                    quality.setdefault(field, dict.fromkeys(_COUNTERS, 0))
+            token = _quality.set(quality)
+            try:
+                return [cls(**dct) for dct in records]
+            finally:
+                _quality.reset(token)
+
+        @staticmethod
+        def merge_quality(quality: dict, other: dict) -> dict:
+            for field, counters in other.items():
+                for counter, count in counters.items():
+                    _count(field, counter, count, quality)
+            return quality
+
+        @classmethod
+        def from_bytes(
+            cls, bytes_: bytes | None, workers: int = 1,
+            quality: dict | None = None
+        ) -> list['Audience.Member']:
             if bytes_:
+                if Objects.is_hashed(bytes_):
+                    # Already normalized and hashed, skip the validators.
+                    table = Objects.gzip_parquet_to_table(bytes_)
+                    return [
+                        cls.model_construct(**dct)
+                        for dct in Objects.table_to_records(table)
+                    ]
+                row_groups = Objects.parquet_row_groups(bytes_)
+                if workers > 1 and row_groups > 1:
+                    return cls._from_bytes_parallel(
+                        bytes_, row_groups, workers, quality)
                 data = Objects.gzip_parquet_to_df(bytes_)
                 records = data.to_dict(orient='records')
-                return [cls(**dct) for dct in records]
+                return cls.validate_records(records, quality)
             else:
                 return None
 
-        @validator('email', pre=True)
-        def strip_lower(value: str | list) -> list:
+        @classmethod
+        def _from_bytes_parallel(
+            cls, bytes_: bytes, row_groups: int, workers: int,
+            quality: dict | None = None
+        ) -> list['Audience.Member']:
+            # Row groups are split across processes reading the same
+            # shared memory copy of the data. Each returns its hashed
+            # columns as an Arrow IPC stream in shared memory, and the
+            # partitions are concatenated back in row group order.
+            partitions = np.array_split(
+                np.arange(row_groups), min(workers, row_groups))
+            shared = Objects.to_shared_memory(bytes_)
+            futures = []
+            try:
+                with ProcessPoolExecutor(len(partitions)) as pool:
+                    futures = [
+                        pool.submit(
+                            _normalize_row_groups, shared.name,
+                            len(bytes_), partition.tolist())
+                        for partition in partitions
+                    ]
+                    members = []
+                    while futures:
+                        name, size, partition_quality = (
+                            futures.pop(0).result())
+                        members.extend(
+                            cls.model_construct(**dct)
+                            for dct in Objects.shared_memory_to_records(
+                                name, size)
+                        )
+                        if quality is not None:
+                            cls.merge_quality(quality, partition_quality)
+            finally:
+                shared.close()
+                shared.unlink()
+                # Blocks returned by the other partitions when one failed
+                # are not read, but still have to be unlinked.
+                for future in futures:
+                    if future.exception() is None:
+                        Objects.unlink_shared_memory(future.result()[0])
+            return members
+
+        @classmethod
+        def spill(
+            cls, bytes_: bytes, batch_size: int,
+            quality: dict | None = None
+        ) -> SpilledRecords:
+            hashed = Objects.is_hashed(bytes_)
+            schema = cls.SCHEMA
+
+            def _hashed_batches():
+                for batch in Objects.gzip_parquet_batches(bytes_, batch_size):
+                    if not hashed:
+                        records = batch.to_pandas().to_dict(orient='records')
+                        frame = cls.to_frame(
+                            cls.validate_records(records, quality))
+                        yield pa.RecordBatch.from_pandas(
+                            frame, schema=schema, preserve_index=False)
+                    else:
+                        yield from pa.Table.from_batches(
+                            [batch]).cast(schema).to_batches()
+
+            return SpilledRecords(
+                Spill(_hashed_batches()),
+                factory=lambda dct: cls.model_construct(**dct)
+            )
+
+        @classmethod
+        def to_frames(
+            cls, data: list['Audience.Member'] | SpilledRecords | None
+        ) -> Iterator[pd.DataFrame]:
+            if isinstance(data, SpilledRecords):
+                yield from data.spill.frames()
+            elif data is not None:
+                yield cls.to_frame(data)
+
+        @classmethod
+        def to_frame(
+            cls, data: list['Audience.Member'] | None
+        ) -> pd.DataFrame | None:
+            if data is None:
+                return None
+            return pd.DataFrame(
+                cls.to_records(data), columns=list(cls.model_fields))
+
+        @classmethod
+        def to_bytes(
+            cls, data: list['Audience.Member'] | SpilledRecords | None,
+            quality: dict | None = None
+        ) -> bytes:
+            metadata = cls._metadata(quality)
+            if isinstance(data, SpilledRecords):
+                return Objects.batches_to_gzip_parquet(
+                    data.spill.batches(), cls.SCHEMA, metadata=metadata)
+            return Objects.df_to_gzip_parquet(
+                cls.to_frame(data), metadata=metadata)
+
+        @classmethod
+        def to_file(
+            cls, data: SpilledRecords, path: str,
+            quality: dict | None = None
+        ) -> None:
+            # Spilled members written batch by batch, never held whole.
+            Objects.write_gzip_parquet(
+                path, data.spill.batches(), cls.SCHEMA,
+                metadata=cls._metadata(quality))
+
+        @classmethod
+        def _metadata(cls, quality: dict | None) -> dict:
+            # Hashed members keep the validation counters they were
+            # normalized with, to be restored when loaded as they are.
+            if not quality:
+                return Objects.HASHED_METADATA
+            return {
+                **Objects.HASHED_METADATA,
+                cls.QUALITY_METADATA: json.dumps(quality).encode('utf-8')
+            }
+
+        @classmethod
+        def stored_quality(cls, bytes_: bytes | None) -> dict | None:
+            if not bytes_:
+                return None
+            quality = Objects.parquet_metadata(bytes_).get(
+                cls.QUALITY_METADATA)
+            return json.loads(quality) if quality else None
+
+        # Validators run from the last defined to the first: values are
+        # split into lists, normalized, then hashed.
+        @field_validator('email', 'phone_number', 'zip_code', mode='before')
+        def to_hashed_list(value: list, info: ValidationInfo) -> list:
+            values = []
+            for element in value:
+                if element is None:
+                    continue
+                if Hash.is_sha256(element):
+                    _count(info.field_name, 'hashed')
+                else:
+                    element = Hash._sha256(element)
+                if element in values:
+                    _count(info.field_name, 'deduplicated')
+                    continue
+                values.append(element)
+            return values
+
+        @field_validator('email', mode='before')
+        def strip_lower(value: list) -> list:
             def _strip_lower(value: str) -> str:
                 if not Hash.is_sha256(value):
                     value = value.strip().lower()
                 return value
-            if isinstance(value, list):
-                value = [
-                    _strip_lower(email)
-                    for email in value
-                ]
-            elif isinstance(value, str):
-                value = _strip_lower(value)
-            else:
-                value = None
-            return value
+            return [_strip_lower(email) for email in value]
 
-        @validator('phone_number', pre=True)
-        def format_e164(value: str | list) -> list:
-            def _format_e164(value: str | int) -> str:
+        @field_validator('phone_number', mode='before')
+        def format_e164(value: list, info: ValidationInfo) -> list:
+            def _format_e164(value: str) -> str | None:
                 if not Hash.is_sha256(value):
+                    # Numbers stored without their leading plus sign are
+                    # still read as international ones.
+                    number = value.strip()
+                    if number.isdigit():
+                        number = f'+{number}'
                     try:
-                        parsed_number = phonenumbers.parse(str(value))
+                        parsed_number = phonenumbers.parse(number)
                         if phonenumbers.is_valid_number(parsed_number):
-                            value = phonenumbers.format_number(
+                            return phonenumbers.format_number(
                                 parsed_number,
                                 phonenumbers.PhoneNumberFormat.E164
                             )
-                        else:
-                            value = None
-                    except phonenumbers.phonenumberutil.NumberFormatException:
-                        value = None
+                    except phonenumbers.NumberParseException:
+                        pass
+                    _count(info.field_name, 'invalid')
+                    return None
                 return value
-            if isinstance(value, str | int):
-                value = _format_e164(value)
-            elif isinstance(value, list):
-                value = [
-                    _format_e164(phone_number)
-                    for phone_number in value
-                ]
-            else:
-                value = None
-            return value
-
-        @validator('email', 'phone_number', 'zip_code', pre=True)
-        def str_to_hashed_list(value: str | list | int) -> list:
-            def _list_to_hashed_list(list: list) -> list:
-                return [Hash.sha256(value) for value in list]
-
-            if isinstance(value, int):
-                value = str(value)
-
-            if not isinstance(value, list):
-                separator = '|'
-                if re.search(fr'.*?{separator}.*', value):
-                    values = value.split(separator)
-                    return _list_to_hashed_list(values)
-                else:
-                    return [Hash.sha256(value)]
+            return [_format_e164(phone_number) for phone_number in value]
+
+        @field_validator('email', 'phone_number', 'zip_code', mode='before')
+        def str_to_list(
+                value: str | list | int | float,
+                info: ValidationInfo) -> list:
+            separator = '|'
+            if isinstance(value, list):
+                values = value
+            elif value is None or value != value:
+                values = [None]
             else:
-                return _list_to_hashed_list(value)
+                if isinstance(value, float) and value.is_integer():
+                    # Whole numbers of a column with nulls are read as
+                    # floats, and written back as the integers they were.
+                    value = int(value)
+                values = str(value).split(separator)
+                if len(values) > 1:
+                    _count(info.field_name, 'split')
+            strings = []
+            for element in values:
+                if (
+                    element is None or element != element
+                    or not str(element).strip()
+                ):
+                    _count(info.field_name, 'empty')
+                    continue
+                if isinstance(element, float) and element.is_integer():
+                    element = int(element)
+                strings.append(str(element))
+            return strings
 
         @staticmethod
-        def to_records(data: list['Audience.Member'] | None) -> list[dict]:
-            if data is None:
+        def to_records(
+            data: list['Audience.Member'] | SpilledRecords | None
+        ) -> list[dict] | SpilledRecords:
+            if isinstance(data, SpilledRecords):
+                records = SpilledRecords(data.spill)
+            elif data is None:
                 records = []
             else:
                 records = [
@@ -141,3 +509,21 @@ class Audience:
                     for member in data
                 ]
             return records
+
+
+def _normalize_row_groups(
+        name: str, size: int, row_groups: list[int]) -> tuple[str, int, dict]:
+    shared = SharedMemory(name=name)
+    try:
+        parquet = pq.ParquetFile(pa.BufferReader(
+            pa.py_buffer(shared.buf[:size])))
+        data = parquet.read_row_groups(row_groups).to_pandas()
+        del parquet
+        records = data.to_dict(orient='records')
+        quality = {}
+        members = Audience.Member.validate_records(records, quality)
+    finally:
+        shared.close()
+    table = pa.Table.from_pandas(
+        Audience.Member.to_frame(members), preserve_index=False)
+    return (*Objects.table_to_shared_memory(table), quality)
@@ -0,0 +1,86 @@
+import pyarrow as pa
+
+from adtechs._adtech import Adtech
+from adtechs.adtechB import AdtechB
+from audience import Audience
+from _utils import Hash
+
+import json
+import statistics
+import sys
+import time
+
+
+# Encoding throughput of the AdtechB request body, in MB of JSON per
+# second, row by row as the other adtechs do, serialized as requests
+# does for json=, against its columnar encoder, from the member records
+# or from their Arrow table as spilled and cached members are read.
+#   python bench_encode.py [members] [repeats]
+
+
+class _RowAdtechB(AdtechB):
+    STATE_KEY = None
+    _COLUMNAR = False
+
+
+def _records(members: int) -> list[dict]:
+    # One hashed email, phone and zip code per member, a second email for
+    # one in five and no phone for one in ten.
+    return [
+        {
+            'email': [Hash._sha256(f'e{index}')] + (
+                [Hash._sha256(f'f{index}')] if index % 5 == 0 else []),
+            'phone_number': (
+                [Hash._sha256(f'p{index}')] if index % 10 else []),
+            'zip_code': [Hash._sha256(f'z{index % 1_000}')]
+        }
+        for index in range(members)
+    ]
+
+
+def _encode(adtech_class: type[Adtech], records: list[dict]) -> bytes:
+    adtech = adtech_class(
+        'name', 'description', {'expiration_time': 30}, records)
+    Adtech.encode([adtech], records, Audience.Member.SCHEMA)
+    return _body(adtech.payload)
+
+
+def _encode_table(table: pa.Table) -> bytes:
+    adtech = AdtechB('name', 'description', {'expiration_time': 30}, [])
+    return _body(adtech._encode_columns(table))
+
+
+def _body(payload: dict | Adtech.JsonBody) -> bytes:
+    if isinstance(payload, Adtech.JsonBody):
+        return b''.join(payload)
+    return json.dumps(payload).encode('utf-8')
+
+
+def main(members: int, repeats: int) -> None:
+    records = _records(members)
+    table = pa.Table.from_pylist(records, schema=Audience.Member.SCHEMA)
+    bodies = {}
+    for label, encode in (
+            ('rows', lambda: _encode(_RowAdtechB, records)),
+            ('columns', lambda: _encode(AdtechB, records)),
+            ('table', lambda: _encode_table(table))):
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            body = encode()
+            seconds.append(time.perf_counter() - start)
+        bodies[label] = body
+        megabytes = len(body) / 1e6
+        print(
+            f'{label:>8}: {megabytes:.1f} MB, median'
+            f' {megabytes / statistics.median(seconds):.0f} MB/s, best'
+            f' {megabytes / min(seconds):.0f} MB/s')
+    rows, columns, table = (json.loads(body) for body in bodies.values())
+    assert rows == columns == table
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    )
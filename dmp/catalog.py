@@ -1,45 +1,643 @@
+import pyarrow as pa
+import ruamel.yaml as ryaml
+
+from adtechs._adtech import Adtech
 from audience import Audience
-from _utils import Objects
+from datasource.segment import Segment
+from planner import Plan
+from scheduler import Job, Scheduler
+from sketch import Sketch
+from spill import SpilledRecords
+from _utils import Hash, Objects, Time
 
 from abc import ABC, abstractmethod
-from collections.abc import Generator
+import asyncio
+from collections import deque
+from collections.abc import AsyncGenerator, Callable, Generator
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+from enum import Enum, unique
+import functools
 import glob
+import itertools
 import os
+import shutil
+import tempfile
+import threading
+import warnings
 
 
 class Catalog(ABC):
     _DATA_DIR = 'data'
+    _JOURNAL_DIR = 'journal'
+    _MEMBERS_DIR = 'members'
+    _SKETCHES_DIR = 'sketches'
     _STATE_DIR = 'state'
+    # Pool of the async object calls, the event loop default when None.
+    _executor: ThreadPoolExecutor | None = None
 
-    def __init__(self, *args, **kwargs) -> None:
+    def __init__(
+            self, *args, workers: int = 1, memory_budget: int | None = None,
+            cache_size: int | None = None, cache_policy: str = 'LRU',
+            **kwargs) -> None:
         self.bucket = ...
-        audience_names: list[str] = [
+        self.workers = workers
+        self.memory_budget = memory_budget
+        self.cache_size = cache_size
+        self.cache_policy = self.CachePolicy[cache_policy.upper()]
+        self._cache_index: dict[str, dict] = self._load_cache_index()
+        self._cache_index_changed = False
+        self.audience_names: list[str] = [
             prefix.split('/')[-1] for prefix in self._list_objects(
                 prefix=self._STATE_DIR, object_extension='yml')
         ]
+        self._journal_lock = threading.Lock()
+        # Cache index and spill stats, shared by the scheduler workers.
+        self._lock = threading.Lock()
+        self.journal: dict[str, dict] = self._load_journal()
         self.audiences: Generator[Audience] = self._fetch_audiences(
-            audience_names)
+            self.audience_names)
+        self._sketches: dict[str, Sketch] = {}
+        self.spill_stats: dict = {
+            'audiences': 0, 'spilled': 0, 'spilled_bytes': 0}
 
     @abstractmethod
     def push_state(self, audience: Audience) -> None:
         object_name = f'{self._STATE_DIR}/{audience.name}.yml'
         content = Objects.dict_to_yaml_bytes(audience.state)
+        # Data stored under the audience name is moved under its hash
+        # right before the state pointing to it.
+        if audience.is_legacy is True:
+            self._move_object(
+                f'{self._DATA_DIR}/{audience.name}.parquet.gz',
+                f'{self._DATA_DIR}/{audience.data_hash}.parquet.gz')
         self._put_object(object_name, content)
 
-        if audience.source.is_new is True:
-            object_name = f'{self._DATA_DIR}/{audience.name}.parquet.gz'
-            content = audience.data
-            self._put_object(object_name, content)
+        spilled_bytes = audience.spilled_bytes
+        with self._lock:
+            self.spill_stats['audiences'] += 1
+            self.spill_stats['spilled'] += int(spilled_bytes > 0)
+            self.spill_stats['spilled_bytes'] += spilled_bytes
+
+        # The data object was stored as soon as normalized, under the
+        # hash of its content.
+        if audience.is_changed is True:
+            object_name = f'{self._SKETCHES_DIR}/{audience.name}.npz'
+            sketch = Sketch.from_frames(
+                Audience.Member.to_frames(audience.members))
+            self._put_object(object_name, sketch.to_bytes())
+            self._sketches[audience.name] = sketch
+
+        self._record(audience.name, 'pushed')
 
     @abstractmethod
     def _fetch_audiences(
             self, audience_names: list[str]) -> Generator[Audience]:
+        for name in self._schedule(audience_names).order:
+            audience = self._fetch_audience(name)
+            if audience is not None:
+                yield audience
+        self._flush_cache_index()
+        self._clear_journal(audience_names)
+
+    def _fetch_audience(self, name: str) -> Audience | None:
+        objects = self._read_audience(name)
+        if objects is None:
+            return None
+        return self._load_audience(name, *objects)
+
+    def _read_audience(
+            self, name: str) -> tuple[dict, bytes | None, bytes | None] | None:
+        # Every object an audience needs from the bucket: its state, its
+        # data and the cached members of that data, if any.
+        entry = self.journal.get(name, {})
+        if 'pushed' in entry.get('stages', []):
+            return None
+        state = Objects.read_yaml_bytes(
+            self._get_object(f'{self._STATE_DIR}/{name}.yml')
+        )
+        data = None
+        if entry.get('data_hash') is not None:
+            data = self._get_object(
+                f'{self._DATA_DIR}/{entry["data_hash"]}.parquet.gz')
+        # Derived audiences are computed again from the current data of
+        # their operands, unless resumed.
+        if data is None and not Segment.is_segment(
+                state[name].get('source') or {}):
+            data = self._get_object(self._data_object(name, state))
+        return state, data, self._get_cached_members(
+            data, entry.get('data_hash') or state[name].get('data_hash'))
+
+    def _load_audience(
+            self, name: str, state: dict, data: bytes | None,
+            normalized: bytes | None) -> Audience:
+        entry = self.journal.get(name, {})
+        audience = Audience(
+            state=state, data=data, loader=self._load_members,
+            workers=self.workers, memory_budget=self.memory_budget,
+            journal=self._record, uploaded=entry.get('uploaded'),
+            normalized=normalized)
+        if normalized is None:
+            self._cache_members(
+                audience.data, audience.members, audience.quality,
+                audience.data_hash)
+        elif (entry.get('data_hash') or state[name].get('data_hash')) is None:
+            # Members cached before the audience had a hash get it now.
+            self._tag_cached_members(audience.data, audience.data_hash)
+        self._record_normalized(audience)
+        return audience
+
+    def run(
+            self, concurrency: int = 1,
+            quotas: dict[str, int] | None = None) -> dict[str, float]:
+        # Fetches, uploads and pushes every audience on a pool of threads
+        # in scheduled order, with at most quotas[key] audiences uploading
+        # to each adtech at once. Returns the seconds each audience took
+        # to be pushed since the start of the run.
+        scheduler = self._schedule(self.audience_names, concurrency, quotas)
+        timings = scheduler.run(self._process)
+        self._flush_cache_index()
+        self._clear_journal(self.audience_names)
+        return timings
+
+    async def push_state_async(self, audience: Audience) -> None:
+        await self._run_io(self.push_state, audience)
+
+    async def _fetch_audiences_async(
+            self, audience_names: list[str],
+            read_ahead: int = 1) -> AsyncGenerator[Audience]:
+        # Same order as _fetch_audiences, with the objects of the next
+        # read_ahead audiences read while one is normalized and handed
+        # over, so bucket reads overlap with validation and uploads.
+        order = (await self._run_io(self._schedule, audience_names)).order
+        names = iter(order)
+        reads = deque(
+            (name, asyncio.ensure_future(self._read_audience_async(name)))
+            for name in itertools.islice(names, max(0, read_ahead) + 1)
+        )
+        try:
+            while reads:
+                name, read = reads.popleft()
+                for next_name in itertools.islice(names, 1):
+                    reads.append((next_name, asyncio.ensure_future(
+                        self._read_audience_async(next_name))))
+                objects = await read
+                if objects is not None:
+                    # Normalization is left off the I/O pool.
+                    yield await asyncio.to_thread(
+                        self._load_audience, name, *objects)
+        finally:
+            for _, read in reads:
+                read.cancel()
+        await self._run_io(self._flush_cache_index)
+        await self._run_io(self._clear_journal, audience_names)
+
+    async def _read_audience_async(
+            self, name: str) -> tuple[dict, bytes | None, bytes | None] | None:
+        return await self._run_io(self._read_audience, name)
+
+    async def _get_object_async(self, object_name) -> bytes | None:
+        return await self._run_io(self._get_object, object_name)
+
+    async def _put_object_async(
+            self, object_name, content: bytes | str) -> None:
+        await self._run_io(self._put_object, object_name, content)
+
+    async def _list_objects_async(
+            self, prefix: str, object_extension: str = 'any',
+            strip_extension: bool = True) -> list:
+        return await self._run_io(
+            self._list_objects, prefix, object_extension, strip_extension)
+
+    async def _run_io(self, function: Callable, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(function, *args))
+
+    def _process(self, name: str) -> None:
+        audience = self._fetch_audience(name)
+        if audience is not None:
+            audience.upload()
+            self.push_state(audience)
+
+    def _schedule(
+            self, audience_names: list[str], workers: int = 1,
+            quotas: dict[str, int] | None = None) -> Scheduler:
+        # Priority and deadline come from the state files, sizes from the
+        # stored data objects, and only adtechs not yet posted count
+        # towards their quota.
+        jobs = []
         for name in audience_names:
             state = Objects.read_yaml_bytes(
-                self._get_object(f'{self._STATE_DIR}/{name}.yml')
-            )
-            data = self._get_object(f'{self._DATA_DIR}/{name}.parquet.gz')
-            yield Audience(state=state, data=data)
+                self._get_object(f'{self._STATE_DIR}/{name}.yml'))
+            _state = state[name]
+            try:
+                size = self._estimate_bytes(name, state)
+            except ValueError as error:
+                # Neither do derived audiences among their own operands.
+                warnings.warn(f'Audience {name}: {error} Ignored.')
+                size = 0
+            params = {
+                'priority': _state.get('priority') or 0,
+                'size': size,
+                'destinations': [
+                    key for key in _state
+                    if key in Adtech.registry
+                    and not (_state[key] or {}).get('id')
+                ]
+            }
+            try:
+                job = Job(name, deadline=_state.get('deadline'), **params)
+            except ValueError as error:
+                # A bad deadline only costs its own audience its place.
+                warnings.warn(f'Audience {name}: {error} Ignored.')
+                job = Job(name, **params)
+            jobs.append(job)
+        return Scheduler(jobs, workers, quotas)
+
+    def _estimate_bytes(
+            self, name: str, state: dict,
+            visited: frozenset[str] = frozenset()) -> int:
+        # Derived audiences not yet stored are as large as their operands.
+        size = self._size_object(self._data_object(name, state))
+        if size is not None:
+            return size
+        return self._operands_bytes(name, state, visited)
+
+    def _operands_bytes(
+            self, name: str, state: dict,
+            visited: frozenset[str] = frozenset()) -> int:
+        return sum(
+            self._estimate_bytes(operand, operand_state, visited | {name})
+            for operand, operand_state in self._operand_states(
+                name, state, visited).items()
+        )
+
+    def _operand_states(
+            self, name: str, state: dict,
+            visited: frozenset[str] = frozenset()) -> dict[str, dict]:
+        # Operands of a derived audience, none of the audiences it is
+        # itself an operand of.
+        source = state[name].get('source') or {}
+        if not Segment.is_segment(source):
+            return {}
+        states = {}
+        for operand in source.get('audiences') or []:
+            if operand in visited:
+                raise ValueError(
+                    f'Operand {operand} of {name} is derived from it.')
+            content = self._get_object(f'{self._STATE_DIR}/{operand}.yml')
+            if content is not None and operand != name:
+                states[operand] = Objects.read_yaml_bytes(content)
+        return states
+
+    def _estimate_members(
+            self, name: str, state: dict,
+            visited: frozenset[str] = frozenset()) -> int | None:
+        # From the sketch of the last push, or else from the data size, or
+        # the members of the operands of derived audiences.
+        try:
+            return self._get_sketches([name])[0].cardinality
+        except ValueError:
+            pass
+        source = state[name].get('source') or {}
+        if not Segment.is_segment(source):
+            size = self._size_object(self._data_object(name, state))
+            return None if size is None else size // Plan._DATA_MEMBER_BYTES
+        counts = [
+            self._estimate_members(operand, operand_state, visited | {name})
+            for operand, operand_state in self._operand_states(
+                name, state, visited).items()
+        ]
+        if not counts or None in counts:
+            return None
+        operation = Segment.Operation[str(source['operation']).upper()]
+        if operation is Segment.Operation.UNION:
+            return sum(counts)
+        if operation is Segment.Operation.INTERSECTION:
+            return min(counts)
+        return counts[0]
+
+    @property
+    def spill_rate(self) -> float:
+        # Share of the audiences pushed so far that did not fit the
+        # memory budget.
+        if self.spill_stats['audiences'] == 0:
+            return 0.0
+        return self.spill_stats['spilled'] / self.spill_stats['audiences']
+
+    def plan(self) -> dict:
+        # Dry run in scheduled order, from the state files, the sizes of
+        # the data objects and the member counts of the sketches.
+        audiences = []
+        for name in self._schedule(self.audience_names).order:
+            state = Objects.read_yaml_bytes(
+                self._get_object(f'{self._STATE_DIR}/{name}.yml'))
+            entry = self.journal.get(name, {})
+            data_size = None
+            if entry.get('data_hash') is not None:
+                data_size = self._size_object(
+                    f'{self._DATA_DIR}/{entry["data_hash"]}.parquet.gz')
+            members = None
+            if data_size is None and Segment.is_segment(
+                    state[name].get('source') or {}):
+                # Derived audiences are computed again from the data of
+                # their operands, left unestimated among their own
+                # operands, as warned when scheduled.
+                try:
+                    data_size = self._operands_bytes(name, state)
+                    members = self._estimate_members(name, state)
+                except ValueError:
+                    data_size = members = None
+            elif data_size is None:
+                data_size = self._size_object(self._data_object(name, state))
+            if data_size is not None and members is None:
+                try:
+                    members = self._get_sketches([name])[0].cardinality
+                except ValueError:
+                    pass
+            cached = self._is_cached(
+                entry.get('data_hash') or state[name].get('data_hash'))
+            audiences.append(Plan(
+                name, state, data_size, members=members, journal=entry,
+                workers=self.workers, cached=cached).to_dict())
+        return {
+            'audiences': audiences,
+            'fetch': [plan['name'] for plan in audiences if plan['fetch']],
+            'pending': {
+                plan['name']: plan['pending']
+                for plan in audiences if plan['pending']
+            },
+            'stale': {
+                plan['name']: plan['stale']
+                for plan in audiences if plan['stale']
+            },
+            'bytes': {
+                stage: sum(plan['bytes'][stage] or 0 for plan in audiences)
+                for stage in ('read', 'hash', 'upload')
+            },
+            'seconds': round(
+                sum(plan['seconds'] for plan in audiences), 3)
+        }
+
+    def estimate_size(self, names: list[str]) -> int:
+        # Distinct members across all given audiences.
+        return Sketch.merge(self._get_sketches(names)).cardinality
+
+    def estimate_overlap(
+            self, names: list[str]) -> dict[tuple[str, str], dict]:
+        sketches = dict(zip(names, self._get_sketches(names)))
+        overlaps = {}
+        for name_a, name_b in itertools.combinations(names, 2):
+            sketch_a, sketch_b = sketches[name_a], sketches[name_b]
+            jaccard = sketch_a.jaccard(sketch_b)
+            union = Sketch.merge([sketch_a, sketch_b]).cardinality
+            overlaps[(name_a, name_b)] = {
+                'jaccard': jaccard,
+                'members': int(round(jaccard * union))
+            }
+        return overlaps
+
+    def _get_sketches(self, names: list[str]) -> list[Sketch]:
+        for name in names:
+            if name not in self._sketches:
+                content = self._get_object(
+                    f'{self._SKETCHES_DIR}/{name}.npz')
+                if content is None:
+                    raise ValueError(
+                        f'No sketch available for audience {name}.')
+                self._sketches[name] = Sketch.from_bytes(content)
+        return [self._sketches[name] for name in names]
+
+    def _load_journal(self) -> dict[str, dict]:
+        # Entries left by a run that did not finish, to resume from. An
+        # entry that cannot be read is resumed as if never journaled.
+        journal = {}
+        for name in self._list_objects(
+                prefix=self._JOURNAL_DIR, object_extension='yml'):
+            entry = self._read_yaml_object(f'{self._JOURNAL_DIR}/{name}.yml')
+            if entry is None:
+                warnings.warn(f'Journal entry {name} unreadable. Ignored.')
+                continue
+            journal[name] = entry
+        return journal
+
+    def _read_yaml_object(self, object_name) -> dict | None:
+        # None for a missing object, and for one left empty or cut short
+        # by a write that did not complete.
+        content = self._get_object(object_name)
+        try:
+            return Objects.read_yaml_bytes(content)
+        except (AttributeError, TypeError, ValueError, ryaml.YAMLError):
+            return None
+
+    def _record(self, name: str, stage: str, **details) -> None:
+        # Journals a completed stage of an audience: 'fetched',
+        # 'normalized', 'uploaded' (per adtech, with its response) or
+        # 'pushed'.
+        with self._journal_lock:
+            entry = self.journal.setdefault(
+                name, {'stages': [], 'uploaded': {}})
+            if stage == 'uploaded':
+                entry['uploaded'][details['adtech']] = details['response']
+            elif stage not in entry['stages']:
+                entry['stages'].append(stage)
+                entry.update(details)
+            self._put_object(
+                f'{self._JOURNAL_DIR}/{name}.yml',
+                Objects.dict_to_yaml_bytes(entry))
+
+    def _record_normalized(self, audience: Audience) -> None:
+        # New data is stored right away, so a resumed run reads it back
+        # by hash instead of fetching it again. Data already stored under
+        # the audience name is read back from there until moved.
+        if audience.is_changed is True and audience.is_legacy is False:
+            object_name = (
+                f'{self._DATA_DIR}/{audience.data_hash}.parquet.gz')
+            if not self._has_object(object_name):
+                self._put_object(object_name, audience.data)
+        if audience.source.is_new is True:
+            self._record(audience.name, 'fetched')
+        self._record(
+            audience.name, 'normalized', data_hash=audience.data_hash)
+
+    def _clear_journal(self, audience_names: list[str]) -> None:
+        # The run is complete once every audience state was pushed.
+        if all(
+            'pushed' in self.journal.get(name, {}).get('stages', [])
+            for name in audience_names
+        ):
+            for name in self.journal:
+                self._delete_object(f'{self._JOURNAL_DIR}/{name}.yml')
+            self.journal = {}
+
+    def _data_object(self, name: str, state: dict) -> str:
+        # Audiences written before content addressing keep their data
+        # under their own name until their next state push.
+        data_hash = state[name].get('data_hash')
+        if data_hash is None:
+            return f'{self._DATA_DIR}/{name}.parquet.gz'
+        return f'{self._DATA_DIR}/{data_hash}.parquet.gz'
+
+    def _load_members(self, name: str) -> pa.Table | None:
+        # Hashed member columns of another catalog audience, read as they
+        # are from the members cache or from data stored already hashed.
+        content = self._get_object(f'{self._STATE_DIR}/{name}.yml')
+        if content is None:
+            return None
+        state = Objects.read_yaml_bytes(content)
+        data = self._get_object(self._data_object(name, state))
+        normalized = self._get_cached_members(
+            data, state[name].get('data_hash'))
+        if normalized is None and Objects.is_hashed(data):
+            normalized = data
+        if normalized is not None:
+            schema = Audience.Member.SCHEMA
+            return Objects.gzip_parquet_to_table(normalized).select(
+                schema.names).cast(schema)
+        # Counted here too, as the operand will then load the cache entry
+        # written with them.
+        quality = {}
+        members = Audience.Member.from_bytes(
+            data, workers=self.workers, quality=quality)
+        if members is None:
+            return None
+        self._cache_members(
+            data, members, quality, state[name].get('data_hash'))
+        return pa.Table.from_pandas(
+            Audience.Member.to_frame(members),
+            schema=Audience.Member.SCHEMA, preserve_index=False)
+
+    @unique
+    class CachePolicy(Enum):
+        # Index field of the entries evicted first, lowest first.
+        LRU = 'last_used'
+        LFU = 'hits'
+
+    def _cache_object(self, data: bytes) -> str:
+        # Keyed by the raw data and the normalization code, so entries
+        # of a previous Member version are never read again.
+        return (
+            f'{self._MEMBERS_DIR}/{Hash.sha256_bytes(data)}'
+            f'-{Audience.Member.version()}.parquet.gz'
+        )
+
+    def _load_cache_index(self) -> dict[str, dict]:
+        index = self._read_yaml_object(
+            f'{self._MEMBERS_DIR}/index.yml') or {}
+        # Entries written by a run that died before saving the index are
+        # added back as never used, to be evicted first.
+        for file_name in self._list_objects(
+                prefix=self._MEMBERS_DIR, object_extension='gz',
+                strip_extension=False):
+            object_name = f'{self._MEMBERS_DIR}/{file_name}'
+            if object_name not in index:
+                index[object_name] = {
+                    'size': self._size_object(object_name) or 0,
+                    'last_used': 0,
+                    'hits': 0
+                }
+        return index
+
+    def _put_cache_index(self) -> None:
+        self._put_object(
+            f'{self._MEMBERS_DIR}/index.yml',
+            Objects.dict_to_yaml_bytes(self._cache_index))
+        self._cache_index_changed = False
+
+    def _flush_cache_index(self) -> None:
+        # Hits and new entries are saved once, at the end of a run.
+        with self._lock:
+            if self._cache_index_changed:
+                self._put_cache_index()
+
+    def _get_cached_members(
+            self, data: bytes | None,
+            data_hash: str | None = None) -> bytes | None:
+        if not data or Objects.is_hashed(data):
+            return None
+        object_name = self._cache_object(data)
+        content = self._get_object(object_name)
+        if content is not None:
+            with self._lock:
+                entry = self._cache_index.pop(object_name, None) or {}
+                self._cache_index[object_name] = {
+                    **entry,
+                    'size': len(content),
+                    'last_used': Time.utc_timestamp(),
+                    'hits': entry.get('hits', 0) + 1,
+                    **({'data_hash': data_hash} if data_hash else {})
+                }
+                self._cache_index_changed = True
+        return content
+
+    def _cache_members(
+            self, data: bytes | None,
+            members: list[Audience.Member] | None,
+            quality: dict | None = None,
+            data_hash: str | None = None) -> None:
+        if not data or members is None or Objects.is_hashed(data):
+            return
+        object_name = self._cache_object(data)
+        if isinstance(members, SpilledRecords):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'members.parquet.gz')
+                Audience.Member.to_file(members, path, quality)
+                size = os.path.getsize(path)
+                self._put_file(object_name, path)
+        else:
+            content = Audience.Member.to_bytes(members, quality)
+            size = len(content)
+            self._put_object(object_name, content)
+        with self._lock:
+            # Along with the hash of the members, for plan() to tell the
+            # audiences it would load from the cache.
+            self._cache_index[object_name] = {
+                'size': size,
+                'last_used': Time.utc_timestamp(),
+                'hits': 0,
+                **({'data_hash': data_hash} if data_hash else {})
+            }
+            self._cache_index_changed = True
+            self._evict_cache()
+
+    def _tag_cached_members(self, data: bytes, data_hash: str) -> None:
+        object_name = self._cache_object(data)
+        with self._lock:
+            entry = self._cache_index.get(object_name)
+            if entry is not None and entry.get('data_hash') != data_hash:
+                entry['data_hash'] = data_hash
+                self._cache_index_changed = True
+
+    def _is_cached(self, data_hash: str | None) -> bool:
+        # Members of that hash cached by the current validation code.
+        suffix = f'-{Audience.Member.version()}.parquet.gz'
+        return data_hash is not None and any(
+            entry.get('data_hash') == data_hash
+            for object_name, entry in self._cache_index.items()
+            if object_name.endswith(suffix)
+        )
+
+    def _evict_cache(self) -> None:
+        # The index is saved right away when objects are deleted, for it
+        # not to list missing ones.
+        if self.cache_size is None:
+            return
+        total = sum(entry['size'] for entry in self._cache_index.values())
+        field = self.cache_policy.value
+        evicted = False
+        for object_name, entry in sorted(
+            self._cache_index.items(),
+            key=lambda item: (item[1][field], item[1]['last_used'])
+        ):
+            if total <= self.cache_size:
+                break
+            self._delete_object(object_name)
+            del self._cache_index[object_name]
+            total -= entry['size']
+            evicted = True
+        if evicted:
+            self._put_cache_index()
 
     @abstractmethod
     def _get_object(self, object_name) -> bytes:
@@ -52,6 +650,34 @@ class Catalog(ABC):
         ...
         pass
 
+    def _put_file(self, object_name, file_path: str) -> None:
+        # Catalogs able to upload from a file without reading it whole
+        # override this.
+        with open(file_path, 'rb') as file:
+            self._put_object(object_name, file.read())
+
+    def _move_object(self, object_name, new_object_name) -> None:
+        # Catalogs able to rename objects in place override this.
+        content = self._get_object(object_name)
+        if content is not None and not self._has_object(new_object_name):
+            self._put_object(new_object_name, content)
+        self._delete_object(object_name)
+
+    @abstractmethod
+    def _has_object(self, object_name) -> bool:
+        ...
+        pass
+
+    @abstractmethod
+    def _delete_object(self, object_name) -> None:
+        ...
+        pass
+
+    @abstractmethod
+    def _size_object(self, object_name) -> int | None:
+        ...
+        pass
+
     @abstractmethod
     def _list_objects(
             self, prefix: str, object_extension: str = 'any',
@@ -63,38 +689,78 @@ class Catalog(ABC):
 
 class Local(Catalog):
     _DATA_DIR = 'data'
+    _JOURNAL_DIR = 'journal'
+    _MEMBERS_DIR = 'members'
+    _SKETCHES_DIR = 'sketches'
     _STATE_DIR = 'state'
+    _PARTIAL_EXTENSION = 'part'
 
-    def __init__(self, bucket_path) -> None:
+    def __init__(
+            self, bucket_path, workers: int = 1,
+            memory_budget: int | None = None,
+            cache_size: int | None = None, cache_policy: str = 'LRU'
+    ) -> None:
         self.bucket = (
             bucket_path if not bucket_path.endswith('/')
             else bucket_path[:-1]
         )
-        audience_names: list[str] = [
+        self.workers = workers
+        self.memory_budget = memory_budget
+        self.cache_size = cache_size
+        self.cache_policy = self.CachePolicy[cache_policy.upper()]
+        self._remove_partial_files()
+        self._cache_index: dict[str, dict] = self._load_cache_index()
+        self._cache_index_changed = False
+        self.audience_names: list[str] = [
             prefix.split('/')[-1] for prefix in self._list_objects(
                 prefix=self._STATE_DIR, object_extension='yml')
         ]
+        self._journal_lock = threading.Lock()
+        # Cache index and spill stats, shared by the scheduler workers.
+        self._lock = threading.Lock()
+        self.journal: dict[str, dict] = self._load_journal()
         self.audiences: Generator[Audience] = self._fetch_audiences(
-            audience_names)
+            self.audience_names)
+        self._sketches: dict[str, Sketch] = {}
+        self.spill_stats: dict = {
+            'audiences': 0, 'spilled': 0, 'spilled_bytes': 0}
 
     def push_state(self, audience: Audience) -> None:
         object_name = f'{self._STATE_DIR}/{audience.name}.yml'
         content = Objects.dict_to_yaml_bytes(audience.state)
+        # Data stored under the audience name is moved under its hash
+        # right before the state pointing to it.
+        if audience.is_legacy is True:
+            self._move_object(
+                f'{self._DATA_DIR}/{audience.name}.parquet.gz',
+                f'{self._DATA_DIR}/{audience.data_hash}.parquet.gz')
         self._put_object(object_name, content)
 
-        if audience.source.is_new is True:
-            object_name = f'{self._DATA_DIR}/{audience.name}.parquet.gz'
-            content = audience.data
-            self._put_object(object_name, content)
+        spilled_bytes = audience.spilled_bytes
+        with self._lock:
+            self.spill_stats['audiences'] += 1
+            self.spill_stats['spilled'] += int(spilled_bytes > 0)
+            self.spill_stats['spilled_bytes'] += spilled_bytes
+
+        # The data object was stored as soon as normalized, under the
+        # hash of its content.
+        if audience.is_changed is True:
+            object_name = f'{self._SKETCHES_DIR}/{audience.name}.npz'
+            sketch = Sketch.from_frames(
+                Audience.Member.to_frames(audience.members))
+            self._put_object(object_name, sketch.to_bytes())
+            self._sketches[audience.name] = sketch
+
+        self._record(audience.name, 'pushed')
 
     def _fetch_audiences(
             self, audience_names: list[str]) -> Generator[Audience]:
-        for name in audience_names:
-            state = Objects.read_yaml_bytes(
-                self._get_object(f'{self._STATE_DIR}/{name}.yml')
-            )
-            data = self._get_object(f'{self._DATA_DIR}/{name}.parquet.gz')
-            yield Audience(state=state, data=data)
+        for name in self._schedule(audience_names).order:
+            audience = self._fetch_audience(name)
+            if audience is not None:
+                yield audience
+        self._flush_cache_index()
+        self._clear_journal(audience_names)
 
     def _get_object(self, object_name) -> bytes | None:
         file_path = os.path.join(self.bucket, object_name)
@@ -105,11 +771,66 @@ class Local(Catalog):
             return None
 
     def _put_object(self, object_name, content: bytes | str) -> None:
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        with self._replace_file(object_name) as file_path:
+            with open(file_path, 'wb') as file:
+                file.write(content)
+
+    def _put_file(self, object_name, file_path: str) -> None:
+        with self._replace_file(object_name) as object_path:
+            shutil.copyfile(file_path, object_path)
+
+    @contextlib.contextmanager
+    def _replace_file(self, object_name) -> Generator[str]:
+        # Objects are written to a hidden file next to them and renamed
+        # over them once complete, so a run killed mid-write leaves the
+        # previous object whole.
+        object_path = os.path.join(self.bucket, object_name)
+        directory = os.path.dirname(object_path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(
+            dir=directory, prefix=f'.{os.path.basename(object_path)}.',
+            suffix=f'.{self._PARTIAL_EXTENSION}')
+        os.close(descriptor)
+        try:
+            yield temp_path
+            os.replace(temp_path, object_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _remove_partial_files(self) -> None:
+        # Hidden files of writes cut short by a killed run.
+        for file_path in glob.glob(os.path.join(
+                self.bucket, '*', f'.*.{self._PARTIAL_EXTENSION}')):
+            os.remove(file_path)
+
+    def _move_object(self, object_name, new_object_name) -> None:
+        new_file_path = os.path.join(self.bucket, new_object_name)
+        os.makedirs(os.path.dirname(new_file_path), exist_ok=True)
+        try:
+            os.replace(
+                os.path.join(self.bucket, object_name), new_file_path)
+        except FileNotFoundError:
+            pass
+
+    def _has_object(self, object_name) -> bool:
+        return os.path.isfile(os.path.join(self.bucket, object_name))
+
+    def _delete_object(self, object_name) -> None:
         file_path = os.path.join(self.bucket, object_name)
-        with open(file_path, 'wb') as file:
-            if isinstance(content, str):
-                content = content.encode('utf-8')
-            file.write(content)
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+    def _size_object(self, object_name) -> int | None:
+        file_path = os.path.join(self.bucket, object_name)
+        try:
+            return os.path.getsize(file_path)
+        except FileNotFoundError:
+            return None
 
     def _list_objects(
             self, prefix: str, object_extension: str = 'any',
@@ -133,3 +854,39 @@ class Local(Catalog):
                     else os.path.splitext(filename)[0]
                 )
         return objects
+
+
+class AsyncLocal(Local):
+    # Local directory read and written from a pool of io_workers threads,
+    # for use from an event loop through the audiences_async generator.
+
+    def __init__(
+            self, bucket_path, workers: int = 1,
+            memory_budget: int | None = None,
+            cache_size: int | None = None, cache_policy: str = 'LRU',
+            io_workers: int = 4, read_ahead: int = 2
+    ) -> None:
+        super().__init__(
+            bucket_path, workers=workers, memory_budget=memory_budget,
+            cache_size=cache_size, cache_policy=cache_policy)
+        self.read_ahead = read_ahead
+        self._executor = ThreadPoolExecutor(io_workers)
+        self.audiences_async: AsyncGenerator[Audience] = (
+            self._fetch_audiences_async(self.audience_names, read_ahead))
+
+    async def __aenter__(self) -> 'AsyncLocal':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    def close(self) -> None:
+        # Waits for the reads and writes already running, and drops the
+        # ones not started yet.
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    async def aclose(self) -> None:
+        # Reads ahead still pending are cancelled along with the
+        # generator, before the pool is shut down off the event loop.
+        await self.audiences_async.aclose()
+        await asyncio.to_thread(self.close)
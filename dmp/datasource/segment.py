@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from datasource._datasource import DataSource
+from _utils import Hash, Objects, Time
+
+from collections.abc import Callable
+from enum import Enum, unique
+
+
+class Segment(DataSource):
+    # Hashed fields identifying a member. Zip codes are shared by many
+    # members, so they never make two members the same.
+    _IDENTIFIERS = ('email', 'phone_number')
+
+    def __init__(
+            self, config: dict,
+            loader: Callable[[str], pa.Table | None]) -> None:
+        self._state: dict = config
+        self.operation = self.Operation[str(config.get('operation')).upper()]
+        self.audiences: list[str] = list(config.get('audiences') or [])
+        if not self.audiences:
+            raise ValueError(
+                f'{self.operation.value} needs at least one audience.')
+        self.loader = loader
+        self.is_new: bool = False
+        self._response: dict = config.get('last_response') or {}
+
+    @staticmethod
+    def is_segment(config: dict) -> bool:
+        return 'operation' in config
+
+    @unique
+    class Operation(Enum):
+        UNION = 'UNION'
+        INTERSECTION = 'INTERSECTION'
+        DIFFERENCE = 'DIFFERENCE'
+
+        def apply(self, tables: list[pa.Table]) -> pd.DataFrame:
+            # Members are matched on their hashed identifiers: a member
+            # is in another audience when any of its emails or phone
+            # numbers is, whatever its other values.
+            identifiers = [Segment._identifiers(table) for table in tables]
+
+            if self is Segment.Operation.UNION:
+                # Members of each audience not already in a previous one.
+                kept, seen = [], np.array([], dtype='S64')
+                for table, (values, rows) in zip(tables, identifiers):
+                    mask = ~Segment._matches(len(table), values, rows, seen)
+                    kept.append(table.filter(mask))
+                    seen = np.union1d(seen, values[mask[rows]])
+                table = pa.concat_tables(kept)
+            else:
+                table, (values, rows) = tables[0], identifiers[0]
+                mask = np.ones(len(table), dtype=bool)
+                for other, _ in identifiers[1:]:
+                    found = Segment._matches(
+                        len(table), values, rows, np.unique(other))
+                    mask &= (
+                        found if self is Segment.Operation.INTERSECTION
+                        else ~found
+                    )
+                table = table.filter(mask)
+
+            # Identical rows are kept once.
+            frame = table.to_pandas()
+            _, first = np.unique(Hash.row_keys(frame), return_index=True)
+            return frame.iloc[np.sort(first)].reset_index(drop=True)
+
+    @staticmethod
+    def _identifiers(table: pa.Table) -> tuple[np.ndarray, np.ndarray]:
+        # Flat hashed identifiers of the members of a table, along with
+        # the row of the member each belongs to.
+        values, rows = [], []
+        for column in Segment._IDENTIFIERS:
+            lists = table.column(column).combine_chunks()
+            values.append(Segment._digests(pc.list_flatten(lists)))
+            rows.append(pc.list_parent_indices(lists).to_numpy())
+        return (
+            np.concatenate(values),
+            np.concatenate(rows).astype(np.int64)
+        )
+
+    @staticmethod
+    def _digests(strings: pa.Array) -> np.ndarray:
+        # Fixed width bytes, read straight from the Arrow buffers when all
+        # are as long as a hash: a quarter of the memory of numpy strings.
+        strings = strings.cast(pa.string())
+        if len(strings) == 0:
+            return np.array([], dtype='S64')
+        lengths = pc.min_max(pc.binary_length(strings)).as_py()
+        if strings.null_count or lengths != {'min': 64, 'max': 64}:
+            return np.array(
+                [value.encode('utf-8') for value in strings.to_pylist()
+                 if value is not None], dtype=bytes)
+        offsets = np.frombuffer(
+            strings.buffers()[1], dtype=np.int32,
+            count=len(strings) + 1, offset=4 * strings.offset)
+        return np.frombuffer(
+            strings.buffers()[2], dtype='S64', count=len(strings),
+            offset=int(offsets[0]))
+
+    @staticmethod
+    def _matches(
+            size: int, values: np.ndarray, rows: np.ndarray,
+            others: np.ndarray) -> np.ndarray:
+        # Rows with any identifier among the others.
+        found = np.zeros(size, dtype=bool)
+        found[rows[np.isin(values, others)]] = True
+        return found
+
+    @property
+    def state(self) -> dict:
+        self._state = {
+            'operation': self.operation.value,
+            'audiences': self.audiences,
+            'last_response': {
+                'date': self.response.get('date', None),
+                'status': self.response.get('status', None),
+                'message': self.response.get('message', None)
+            }
+        }
+        return self._state
+
+    @property
+    def response(self) -> dict:
+        return self._response
+
+    @response.setter
+    def response(self, response) -> None:
+        self._response = response
+
+    def get_audience_data(self) -> bytes | None:
+        tables = {name: self.loader(name) for name in self.audiences}
+        missing = [name for name, table in tables.items() if table is None]
+        if missing:
+            self.response = {
+                'date': Time.NOW().strftime('%Y%m%d'),
+                'status': 404,
+                'message': f'Missing audience data: {", ".join(missing)}.'
+            }
+            return None
+
+        frame = self.operation.apply(list(tables.values()))
+        self.response = {
+            'date': Time.NOW().strftime('%Y%m%d'),
+            'status': 200,
+            'message': (
+                f'Success: {self.operation.value} of {len(tables)}'
+                f' audiences, {len(frame)} members.')
+        }
+        self.is_new = True
+        return Objects.df_to_gzip_parquet(
+            frame, metadata=Objects.HASHED_METADATA)
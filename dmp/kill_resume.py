@@ -0,0 +1,166 @@
+from adtechs._adtech import Adtech
+from catalog import Local
+from _utils import Objects
+
+from collections import Counter
+import itertools
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+
+
+# Kills local catalog runs at random object writes, journal records and
+# adtech posts, or with SIGKILL after a random delay, reruns each one
+# until it completes, then checks every audience was posted once to each
+# adtech and the journal was cleared.
+#   python kill_resume.py ../bucket [trials] [audiences]
+_MAX_RUNS = 200
+_MAX_KILL_DELAY = 2.0
+
+
+def _prepare(bucket: str, path: str, audiences: int) -> None:
+    # Copies of the first audience of the bucket, none posted yet.
+    shutil.copytree(os.path.join(bucket, 'data'), os.path.join(path, 'data'))
+    os.makedirs(os.path.join(path, 'state'))
+    name = sorted(os.listdir(os.path.join(bucket, 'state')))[0][:-4]
+    with open(os.path.join(bucket, 'state', f'{name}.yml'), 'rb') as file:
+        state = Objects.read_yaml_bytes(file.read())[name]
+    for index in range(audiences):
+        copy = f'{name}_{index}'
+        if state.get('data_hash') is None:
+            shutil.copyfile(
+                os.path.join(path, 'data', f'{name}.parquet.gz'),
+                os.path.join(path, 'data', f'{copy}.parquet.gz'))
+        adtechs = {
+            key: {**value, 'id': None, 'name': copy}
+            for key, value in state.items() if key in Adtech.registry
+        }
+        Objects.save_yaml_from_bytes(
+            Objects.dict_to_yaml_bytes({copy: {**state, **adtechs}}),
+            os.path.join(path, 'state', f'{copy}.yml'))
+
+
+def _child(path: str, kill_at: int, log: str) -> None:
+    events = itertools.count(1)
+
+    def _write(line: str) -> None:
+        with open(log, 'a') as file:
+            file.write(f'{line}\n')
+
+    def _point(line: str) -> None:
+        if next(events) == kill_at:
+            _write(f'kill {line}')
+            os._exit(1)
+
+    put_object, record, upload = Local._put_object, Local._record, (
+        Adtech.upload)
+
+    def _put_object(self, object_name, content) -> None:
+        _point(f'write {object_name}')
+        put_object(self, object_name, content)
+
+    def _record(self, name: str, stage: str, **details) -> None:
+        _point(f'record {name} {stage} {details.get("adtech", "")}')
+        record(self, name, stage, **details)
+        if stage == 'uploaded':
+            _write(f'journaled {name} {details["adtech"]}')
+
+    def _upload(self) -> dict:
+        _point(f'post {self.audience_name} {self.STATE_KEY}')
+        response = upload(self)
+        _write(f'posted {self.audience_name} {self.STATE_KEY}')
+        return response
+
+    Local._put_object, Local._record, Adtech.upload = (
+        _put_object, _record, _upload)
+
+    catalog = Local(path)
+    for audience in catalog.audiences:
+        audience.upload()
+        catalog.push_state(audience)
+
+
+def _reposted(lines: list[list[str]]) -> Counter:
+    # Posts accepted but killed before journaled, the ones a resumed run
+    # posts again since it cannot tell they went through.
+    reposted, last = Counter(), {}
+    for event, *key in lines:
+        if event in ('posted', 'journaled'):
+            if event == last.get(tuple(key)) == 'posted':
+                reposted[tuple(key)] += 1
+            last[tuple(key)] = event
+    return reposted
+
+
+def _check(path: str, log: str, audiences: int) -> int:
+    with open(log) as file:
+        lines = [line.split() for line in file]
+    posted = Counter(tuple(line[1:]) for line in lines if line[0] == 'posted')
+    reposted = _reposted(lines)
+    states = {
+        name: Objects.read_yaml_bytes(open(
+            os.path.join(path, 'state', f'{name}.yml'), 'rb').read())[name]
+        for name in (
+            file[:-4] for file in os.listdir(os.path.join(path, 'state')))
+    }
+    assert len(states) == audiences, states
+    for name, state in states.items():
+        for key in (key for key in state if key in Adtech.registry):
+            assert state[key]['id'], (name, key)
+            assert posted[(name, key)] == 1 + reposted[(name, key)], (
+                name, key, posted[(name, key)])
+        assert not os.path.exists(os.path.join(
+            path, 'data', f'{name}.parquet.gz')), (name, 'data not moved')
+    assert not os.listdir(os.path.join(path, 'journal')), 'journal left'
+    return sum(reposted.values())
+
+
+def main(bucket: str, trials: int, audiences: int) -> None:
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for trial in range(trials):
+        with tempfile.TemporaryDirectory() as path:
+            bucket_path = os.path.join(path, 'bucket')
+            log = os.path.join(path, 'events.log')
+            _prepare(bucket, bucket_path, audiences)
+            for runs in range(1, _MAX_RUNS + 1):
+                kill_at = random.randint(1, 12 * audiences)
+                process = subprocess.Popen(
+                    [
+                        sys.executable, __file__, '--child', bucket_path,
+                        str(kill_at), log
+                    ],
+                    cwd=directory
+                )
+                # Every other run is also killed from outside after a
+                # random delay, wherever it is, halfway through writing
+                # an object included.
+                try:
+                    process.wait(
+                        random.uniform(0, _MAX_KILL_DELAY)
+                        if random.random() < 0.5 else None)
+                except subprocess.TimeoutExpired:
+                    process.send_signal(signal.SIGKILL)
+                    process.wait()
+                if process.returncode == 0:
+                    break
+            else:
+                raise AssertionError(f'Not done after {_MAX_RUNS} runs.')
+            reposted = _check(bucket_path, log, audiences)
+            print(
+                f'Trial {trial}: done after {runs} runs, {runs - 1} kills,'
+                f' {reposted} posts repeated after an unjournaled kill.')
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == '--child':
+        _child(sys.argv[2], int(sys.argv[3]), sys.argv[4])
+    else:
+        main(
+            os.path.abspath(sys.argv[1]),
+            int(sys.argv[2]) if len(sys.argv) > 2 else 10,
+            int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        )
@@ -12,14 +12,9 @@ if __name__ == '__main__':
     # a DataSource attribute of the Audience instance fetches the
     # data and saves at Audience instance attribute level.
     for audience in catalog.audiences:
-        # Checking for current POST status of each audience.
-        if audience.adtech_a.status.value == 0:
-            # Pushes custom payload to endpoint if new audience.
-            audience.adtech_a.upload()
-
-        # Repeat for every target destination.
-        if audience.adtech_b.status.value == 0:
-            audience.adtech_b.upload()
+        # Pushes custom payloads to every adtech configured in the
+        # audience state that was not yet posted, concurrently.
+        audience.upload()
 
         # Update the catalog bucket with final updated states of all
         # audiences. New YAML and parquet.gz files are uploaded to the
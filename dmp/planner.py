@@ -0,0 +1,124 @@
+from adtechs._adtech import Adtech
+from datasource.segment import Segment
+from _utils import Time
+
+from datetime import datetime, timedelta
+
+
+class Plan:
+    # What a run would do for one audience, estimated from its state and
+    # the metadata of its objects only, without reading any member data.
+    _READ_RATE = 200_000_000
+    _NORMALIZE_RATE = 30_000
+    _UPLOAD_RATE = 10_000_000
+    _DATA_MEMBER_BYTES = 32
+    _PAYLOAD_MEMBER_BYTES = 250
+
+    def __init__(
+            self, name: str, state: dict, data_size: int | None,
+            members: int | None = None, journal: dict | None = None,
+            workers: int = 1, cached: bool = False) -> None:
+        self.name = name
+        _state = state[name]
+        _source = _state.get('source') or {}
+        journal = journal or {}
+        self.is_pushed: bool = 'pushed' in journal.get('stages', [])
+        self.is_derived: bool = Segment.is_segment(_source)
+        self.needs_fetch: bool = (
+            data_size is None and not self.is_derived and not self.is_pushed)
+        self.is_cached: bool = cached and not self.needs_fetch
+        self.data_size = data_size
+        if members is None and data_size is not None:
+            members = data_size // self._DATA_MEMBER_BYTES
+        self.members = members
+        self.workers = max(1, workers)
+
+        uploaded = journal.get('uploaded', {})
+        today = Time.NOW().strftime('%Y%m%d')
+        self.adtechs: dict[str, str] = {}
+        for key in _state:
+            if key not in Adtech.registry:
+                continue
+            _adtech = _state[key] or {}
+            if key in uploaded or self.is_pushed:
+                status = Adtech.Status.POSTED.name
+            elif not _adtech.get('id'):
+                status = Adtech.Status.NOT_POSTED.name
+            elif self._is_expired(_adtech, today):
+                status = 'STALE'
+            else:
+                status = Adtech.Status.POSTED.name
+            self.adtechs[key] = status
+
+    @staticmethod
+    def _is_expired(adtech_state: dict, today: str) -> bool:
+        # Posted longer ago than the expiration set for the audience, if
+        # any. An expiration of 1000 days never expires.
+        expiration = adtech_state.get('expiration_time')
+        posted = (adtech_state.get('last_response') or {}).get('date')
+        if expiration is None or int(expiration) == 1_000 or not posted:
+            return False
+        expires = datetime.strptime(str(posted), '%Y%m%d') + timedelta(
+            days=int(expiration))
+        return expires.strftime('%Y%m%d') < today
+
+    @property
+    def pending(self) -> list[str]:
+        return [
+            key for key, status in self.adtechs.items()
+            if status == Adtech.Status.NOT_POSTED.name
+        ]
+
+    @property
+    def stale(self) -> list[str]:
+        return [
+            key for key, status in self.adtechs.items() if status == 'STALE']
+
+    @property
+    def read_bytes(self) -> int | None:
+        # Data yet to be fetched is not sized until it is.
+        return 0 if self.is_pushed else self.data_size
+
+    @property
+    def hash_bytes(self) -> int | None:
+        # Derived audiences are stored already hashed, and cached members
+        # are loaded as they are.
+        if self.is_pushed or self.is_derived or self.is_cached:
+            return 0
+        return self.data_size
+
+    @property
+    def upload_bytes(self) -> int | None:
+        if self.members is None:
+            return None
+        return (
+            self.members * self._PAYLOAD_MEMBER_BYTES * len(self.pending))
+
+    @property
+    def seconds(self) -> float:
+        # Known stages only, a fetch is not estimated.
+        seconds = (self.read_bytes or 0) / self._READ_RATE
+        if self.hash_bytes:
+            seconds += (self.members or 0) / (
+                self._NORMALIZE_RATE * self.workers)
+        seconds += (self.upload_bytes or 0) / self._UPLOAD_RATE
+        return round(seconds, 3)
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'pushed': self.is_pushed,
+            'fetch': self.needs_fetch,
+            'derived': self.is_derived,
+            'cached': self.is_cached,
+            'members': self.members,
+            'adtechs': self.adtechs,
+            'pending': self.pending,
+            'stale': self.stale,
+            'bytes': {
+                'read': self.read_bytes,
+                'hash': self.hash_bytes,
+                'upload': self.upload_bytes
+            },
+            'seconds': self.seconds
+        }
@@ -0,0 +1,143 @@
+from _utils import Time
+
+from collections import deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+import math
+import threading
+import time
+
+
+class Job:
+    # One audience to process. Jobs run by priority (highest first), then
+    # deadline (earliest first) and estimated size (smallest first).
+    def __init__(
+            self, name: str, priority: int = 0,
+            deadline: str | date | datetime | None = None, size: int = 0,
+            destinations: Iterable[str] = ()) -> None:
+        self.name = name
+        self.priority = priority
+        self.deadline = (
+            self._timestamp(deadline) if deadline is not None else None)
+        self.size = size
+        self.destinations: list[str] = list(destinations)
+
+    @staticmethod
+    def _timestamp(deadline: str | date | datetime) -> int:
+        # ISO dates and timestamps, as written or as loaded from YAML.
+        # Dates are due at midnight, and naive timestamps are UTC.
+        if isinstance(deadline, datetime):
+            value = deadline
+        elif isinstance(deadline, date):
+            value = datetime(deadline.year, deadline.month, deadline.day)
+        else:
+            try:
+                value = datetime.fromisoformat(str(deadline).strip())
+            except ValueError:
+                raise ValueError(
+                    f'Invalid deadline {deadline!r}, expected an ISO date'
+                    ' or timestamp.') from None
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return Time.utc_timestamp(value)
+
+    @property
+    def key(self) -> tuple:
+        return (
+            -self.priority,
+            self.deadline if self.deadline is not None else math.inf,
+            self.size,
+            self.name
+        )
+
+
+class Scheduler:
+    # Jobs are dealt in order to one queue per worker. A worker takes the
+    # first job of its own queue whose destinations are under quota, or
+    # steals from the front of another queue when it holds a job of a
+    # higher priority or an earlier deadline, so a few large audiences
+    # cannot hold back the rest of the pool, and lower priority ones never
+    # run ahead of the jobs waiting behind them.
+    def __init__(
+            self, jobs: Iterable[Job], workers: int = 1,
+            quotas: dict[str, int] | None = None) -> None:
+        self.jobs: list[Job] = sorted(jobs, key=lambda job: job.key)
+        self.workers = max(1, workers)
+        self.quotas: dict[str, int] = quotas or {}
+        for destination, quota in self.quotas.items():
+            if quota < 1:
+                raise ValueError(
+                    f'Quota of {destination} must be at least 1.')
+        self._queues: list[deque[Job]] = [
+            deque() for _ in range(self.workers)]
+        for index, job in enumerate(self.jobs):
+            self._queues[index % self.workers].append(job)
+        self._in_flight: dict[str, int] = {}
+        self._condition = threading.Condition()
+        self.timings: dict[str, float] = {}
+
+    @property
+    def order(self) -> list[str]:
+        return [job.name for job in self.jobs]
+
+    def run(self, task: Callable[[str], None]) -> dict[str, float]:
+        # Seconds from the start of the run to the end of each job.
+        start = time.monotonic()
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = [
+                pool.submit(self._work, index, task, start)
+                for index in range(self.workers)
+            ]
+            for future in futures:
+                future.result()
+        return self.timings
+
+    def _work(
+            self, index: int, task: Callable[[str], None],
+            start: float) -> None:
+        while (job := self._take(index)) is not None:
+            try:
+                task(job.name)
+            finally:
+                self._release(job)
+                self.timings[job.name] = time.monotonic() - start
+
+    def _take(self, index: int) -> Job | None:
+        with self._condition:
+            while True:
+                if not any(self._queues):
+                    return None
+                # First job under quota of each queue, own queue first.
+                firsts = [
+                    (queue, next(
+                        (job for job in queue if self._has_quota(job)), None))
+                    for queue in (
+                        self._queues[index:] + self._queues[:index])
+                ]
+                firsts = [(queue, job) for queue, job in firsts if job]
+                if firsts:
+                    # Jobs of a higher priority, or as high but due
+                    # earlier, are stolen from the front of another queue.
+                    queue, job = min(
+                        firsts, key=lambda first: first[1].key[:2])
+                    queue.remove(job)
+                    for destination in job.destinations:
+                        self._in_flight[destination] = (
+                            self._in_flight.get(destination, 0) + 1)
+                    return job
+                # Every remaining job waits on a destination at quota.
+                self._condition.wait()
+
+    def _has_quota(self, job: Job) -> bool:
+        return all(
+            self._in_flight.get(destination, 0)
+            < self.quotas.get(destination, math.inf)
+            for destination in job.destinations
+        )
+
+    def _release(self, job: Job) -> None:
+        with self._condition:
+            for destination in job.destinations:
+                self._in_flight[destination] -= 1
+            self._condition.notify_all()
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+from _utils import Hash
+
+from collections.abc import Iterable
+import hashlib
+from io import BytesIO
+
+
+class Sketch:
+    # HyperLogLog with 2^14 registers (~0.8% standard error) for
+    # cardinality and a 128-permutation MinHash signature for Jaccard.
+    _PRECISION = 14
+    _PERMUTATIONS = 128
+    _CHUNK_SIZE = 8_192
+    _SEED = 20231107
+
+    def __init__(self, registers: np.ndarray, signature: np.ndarray) -> None:
+        self.registers: np.ndarray = registers
+        self.signature: np.ndarray = signature
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame | None) -> 'Sketch':
+        keys = Hash.row_keys(frame) if frame is not None else []
+        hashes = np.frombuffer(
+            b''.join(
+                hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+                for key in keys
+            ),
+            dtype='<u8'
+        )
+        return cls(cls._registers(hashes), cls._signature(hashes))
+
+    @classmethod
+    def from_frames(cls, frames: Iterable[pd.DataFrame]) -> 'Sketch':
+        sketch = cls.from_frame(None)
+        for frame in frames:
+            sketch = cls.merge([sketch, cls.from_frame(frame)])
+        return sketch
+
+    @classmethod
+    def from_bytes(cls, bytes_: bytes) -> 'Sketch':
+        with np.load(BytesIO(bytes_)) as arrays:
+            return cls(arrays['registers'], arrays['signature'])
+
+    def to_bytes(self) -> bytes:
+        stream = BytesIO()
+        np.savez_compressed(
+            stream, registers=self.registers, signature=self.signature)
+        sketch_bytes = stream.getvalue()
+        stream.close()
+        return sketch_bytes
+
+    @classmethod
+    def merge(cls, sketches: list['Sketch']) -> 'Sketch':
+        return cls(
+            np.maximum.reduce([sketch.registers for sketch in sketches]),
+            np.minimum.reduce([sketch.signature for sketch in sketches])
+        )
+
+    @property
+    def cardinality(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m ** 2 / np.sum(
+            np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def jaccard(self, other: 'Sketch') -> float:
+        empty = np.iinfo(np.uint64).max
+        filled = (self.signature != empty) | (other.signature != empty)
+        if not filled.any():
+            return 0.0
+        return float(np.mean(self.signature == other.signature))
+
+    @classmethod
+    def _registers(cls, hashes: np.ndarray) -> np.ndarray:
+        p = cls._PRECISION
+        q = 64 - p
+        registers = np.zeros(2 ** p, dtype=np.uint8)
+        if len(hashes):
+            index = (hashes >> np.uint64(q)).astype(np.intp)
+            remainder = hashes & np.uint64((1 << q) - 1)
+            # Position of the leftmost 1-bit in the remaining q bits, exact
+            # through float64 since q < 53.
+            _, bit_length = np.frexp(remainder.astype(np.float64))
+            rank = (q - bit_length + 1).astype(np.uint8)
+            np.maximum.at(registers, index, rank)
+        return registers
+
+    @classmethod
+    def _signature(cls, hashes: np.ndarray) -> np.ndarray:
+        rng = np.random.default_rng(cls._SEED)
+        info = np.iinfo(np.uint64)
+        a = rng.integers(0, info.max, cls._PERMUTATIONS, dtype=np.uint64) | 1
+        b = rng.integers(0, info.max, cls._PERMUTATIONS, dtype=np.uint64)
+        signature = np.full(cls._PERMUTATIONS, info.max, dtype=np.uint64)
+        for start in range(0, len(hashes), cls._CHUNK_SIZE):
+            chunk = hashes[start:start + cls._CHUNK_SIZE]
+            # Multiply-add modulo 2^64 as the family of permutations.
+            permuted = a[:, None] * chunk[None, :] + b[:, None]
+            signature = np.minimum(signature, permuted.min(axis=1))
+        return signature
@@ -0,0 +1,100 @@
+import pandas as pd
+import pyarrow as pa
+
+from _utils import Objects
+
+from collections.abc import Callable, Iterable, Iterator
+import json
+import os
+import tempfile
+import weakref
+
+
+class Spill:
+    # Arrow record batches written to a temporary IPC file, and read back
+    # memory-mapped one batch at a time. The file is removed along with
+    # the instance.
+    def __init__(self, batches: Iterable[pa.RecordBatch]) -> None:
+        self.path: str | None = None
+        self.num_rows: int = 0
+        self.nbytes: int = 0
+        writer = None
+        for batch in batches:
+            if writer is None:
+                self._create()
+                writer = pa.ipc.new_file(self.path, batch.schema)
+            writer.write_batch(batch)
+            self.num_rows += batch.num_rows
+        if writer is not None:
+            writer.close()
+            self.nbytes = os.path.getsize(self.path)
+
+    def _create(self) -> None:
+        descriptor, self.path = tempfile.mkstemp(suffix='.arrow')
+        os.close(descriptor)
+        weakref.finalize(self, os.remove, self.path)
+
+    def batches(self) -> Iterator[pa.RecordBatch]:
+        if self.path is None:
+            return
+        with pa.memory_map(self.path) as source:
+            reader = pa.ipc.open_file(source)
+            for index in range(reader.num_record_batches):
+                yield reader.get_batch(index)
+
+    def frames(self) -> Iterator[pd.DataFrame]:
+        for batch in self.batches():
+            yield batch.to_pandas()
+
+
+class SpilledRecords:
+    # List-like view over the rows of a Spill, built one batch at a time.
+    def __init__(
+            self, spill: Spill, factory: Callable[[dict], object] = dict
+    ) -> None:
+        self.spill = spill
+        self.factory = factory
+
+    def __len__(self) -> int:
+        return self.spill.num_rows
+
+    def __iter__(self) -> Iterator:
+        for records in self.batches():
+            yield from records
+
+    def batches(self) -> Iterator[list]:
+        for batch in self.spill.batches():
+            yield [
+                self.factory(dct)
+                for dct in Objects.table_to_records(
+                    pa.Table.from_batches([batch]))
+            ]
+
+
+class SpilledPayloads:
+    # Payload batches appended as JSON lines to a temporary file, to be
+    # posted one at a time.
+    def __init__(self, payloads: Iterable[dict] = ()) -> None:
+        descriptor, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(descriptor)
+        weakref.finalize(self, os.remove, self.path)
+        self.nbytes: int = 0
+        for payload in payloads:
+            self.append(payload)
+
+    def append(self, payload: dict | Iterable[bytes]) -> None:
+        # Dicts are serialized here, and already serialized bodies are
+        # written as they are.
+        with open(self.path, 'ab') as file:
+            if isinstance(payload, dict):
+                file.write(json.dumps(payload).encode('utf-8'))
+            else:
+                for chunk in payload:
+                    file.write(chunk)
+            file.write(b'\n')
+        self.nbytes = os.path.getsize(self.path)
+
+    def __iter__(self) -> Iterator[dict]:
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                yield json.loads(line)